@@ -11,39 +11,179 @@
 from __future__ import print_function, division, absolute_import
 import sys
 import os
-import argparse
-import glob
-import shutil
+import errno
 import time
 import re
+import threading
+import types
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# snapshot of the startup environment, for variables setup_tree never modifies
+_ENV = dict(os.environ)
 
-def _remove_link(link):
-    ''' Remove a symlink if it exists
+# the tree python package directory next to this script
+_PYPATH = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                       '..', 'python'))
+
+# whether symlinks can be made relative to an open directory descriptor; os.replace
+# never appears in os.supports_dir_fd, so os.rename (the same renameat call) stands in
+_HAS_DIR_FD = (hasattr(os, 'O_DIRECTORY') and
+               {os.symlink, os.rename, os.unlink} <= os.supports_dir_fd)
+
+# sendfile errors meaning it does not support copying between regular files
+_SENDFILE_UNSUPPORTED = (errno.ENOTSOCK, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+# temporary symlink names left by make_symlink, as NAME.<pid>.tmp
+_STALE_LINK = re.compile(r'\.\d+\.tmp$')
+
+# the Tree class, once imported by _prepare_tree_import
+_Tree = None
+
+# serializes output from the per-config worker threads
+_print_lock = threading.Lock()
+
+
+def _print(*args):
+    ''' Print a message without interleaving it with other worker threads '''
+    with _print_lock:
+        print(*args)
+
+
+# header of the env index file
+INDEX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><meta name="viewport" content="width=device-width"/><meta http-equiv="content-type" content="text/html; charset=utf-8"/><style type="text/css">body,html {{background:#fff;font-family:"Bitstream Vera Sans","Lucida Grande","Lucida Sans Unicode",Lucidux,Verdana,Lucida,sans-serif;}}tr:nth-child(even) {{background:#f4f4f4;}}th,td {{padding:0.1em 0.5em;}}th {{text-align:left;font-weight:bold;background:#eee;border-bottom:1px solid #aaa;}}#list {{border:1px solid #aaa;width:100%%;}}a {{color:#a33;}}a:hover {{color:#e33;}}</style>
+<link rel="stylesheet" href="{url}/css/sas.css" type="text/css"/>
+<title>Index of /sas/{name}/env/</title>
+</head><body><h1>Index of /sas/{name}/env/</h1>
+"""
+
+# footer of the env index file
+INDEX_FOOTER = """<h3><a href='{url}/sas/'>{location}</a></h3>
+<p>This directory contains links to the contents of
+environment variables defined by the tree product, version {name}.
+To examine the <em>types</em> of files contained in each environment variable
+directory, visit <a href="/datamodel/files/">the datamodel.</a></p>
+</body></html>
+"""
+
+
+def _scan_links(envdir):
+    ''' Scan a directory once for its existing entries
 
     Parameters:
-        link (str):
-            The symlink filepath
+        envdir (str):
+            The filepath for the env directory
+    Returns:
+        A dictionary mapping each entry name to whether it is a symlink
+    '''
+    try:
+        with os.scandir(envdir) as entries:
+            return {entry.name: entry.is_symlink() for entry in entries}
+    except OSError:
+        return {}
+
+
+def _find_files(path, ext):
+    ''' Find the files in a directory with a given extension
+
+    Parameters:
+        path (str):
+            The directory to search
+        ext (str):
+            The file extension to match, e.g. ".cfg"
+    Returns:
+        A list of matching file paths
     '''
-    if os.path.islink(link):
-        os.remove(link)
+    try:
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries if entry.name.endswith(ext) and
+                    not entry.name.startswith('.') and entry.is_file()]
+    except OSError:
+        return []
 
 
-def make_symlink(src, link):
+def _copy_file(src, dst):
+    ''' Copy the contents of a file
+
+    Uses os.sendfile to copy the data within the kernel, falling back to a
+    regular buffered copy where that is not supported.  File metadata is not
+    copied.
+
+    Parameters:
+        src (str):
+            The source file path
+        dst (str):
+            The destination file path
+    '''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if hasattr(os, 'sendfile'):
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            try:
+                while offset < size:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError as err:
+                # only fall back when sendfile cannot handle these files at all
+                if offset or err.errno not in _SENDFILE_UNSUPPORTED:
+                    raise
+
+        import shutil
+
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _remove_stale_links(existing, envdir, dir_fd=None):
+    ''' Remove temporary symlinks left behind by killed runs
+
+    Parameters:
+        existing (dict):
+            The scanned contents of envdir, as returned by _scan_links.  Removed
+            entries are dropped from it.
+        envdir (str):
+            The filepath for the env directory
+        dir_fd (int):
+            An open descriptor for envdir, used to remove the links relative to it
+    '''
+    for name, is_link in list(existing.items()):
+        if is_link and _STALE_LINK.search(name):
+            os.unlink(name if dir_fd is not None else os.path.join(envdir, name), dir_fd=dir_fd)
+            del existing[name]
+
+
+def make_symlink(src, link, dir_fd=None):
     '''create a symlink
 
+    The symlink is created under a temporary name and renamed into place,
+    atomically replacing any existing symlink at link.
+
     Parameters:
         src (str):
             The fullpath source of the symlink
         link (str):
             The symlink file path
+        dir_fd (int):
+            An open directory descriptor that link is relative to
     '''
-    _remove_link(link)
-    os.symlink(src, link)
-
-
-def create_index_table(environ, envdir):
+    # per-process temporary name, so concurrent runs do not collide; stale ones
+    # left by killed runs are cleared by _remove_stale_links
+    tmp = '{0}.{1}.tmp'.format(link, os.getpid())
+    os.symlink(src, tmp, dir_fd=dir_fd)
+    try:
+        os.replace(tmp, link, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        # never leave a stray temporary link behind, even when interrupted
+        os.unlink(tmp, dir_fd=dir_fd)
+        raise
+
+
+def create_index_table(environ, envdir, existing=None, dir_fd=None):
     ''' create an html table
 
     Parameters:
@@ -51,6 +191,10 @@ def create_index_table(environ, envdir):
             A tree environment dictionary
         envdir (str):
             The filepath for the env directory
+        existing (dict):
+            The scanned contents of envdir, as returned by _scan_links
+        dir_fd (int):
+            An open descriptor for envdir, used to create the links relative to it
     Returns:
         An html table definition string
     '''
@@ -62,9 +206,23 @@ def create_index_table(environ, envdir):
 </thead><tbody>
     <tr><td><a href="../">Parent directory/</a></td><td>-</td><td>-</td></tr>"""
     table_footer = """</tbody></table>"""
+    table_row = '    <tr><td><a href="{0}/">{0}/</a></td><td>-</td><td>{1}</td></tr>\n'
+
+    # the config name, to tell apart output from concurrently processed configs
+    config = environ['default']['name']
+
+    # look up the current contents of the env directory once
+    if existing is None:
+        existing = _scan_links(envdir)
+
+    # stat results of the source paths, shared across sections
+    stats = {}
+
+    # formatted local times, keyed by whole-second mtime
+    stattimes = {}
 
     # create table
-    table = table_header
+    table = [table_header]
 
     # loop over the environment
     for section, values in environ.items():
@@ -72,47 +230,77 @@ def create_index_table(environ, envdir):
             continue
 
         for tree_name, tree_path in values.items():
-            skipmsg = 'Skipping {0} for {1}'.format(tree_name, section)
             if '_ROOT' in tree_name:
                 continue
 
             # create the src and target links
             src = tree_path
-            link = os.path.join(envdir, tree_name.upper())
-
-            # get the local time of the symlink
-            try:
-                stattime = time.strftime('%d-%b-%Y %H:%M', time.localtime(os.stat(src).st_mtime))
-            except OSError:
-                print("{0} does not appear to exist, skipping...".format(src))
-                _remove_link(link)
+            name = tree_name.upper()
+            link = name if dir_fd is not None else os.path.join(envdir, name)
+
+            # stat each source once; a failure, cached as None, means it does not exist
+            if src not in stats:
+                try:
+                    stats[src] = os.stat(src)
+                except OSError:
+                    stats[src] = None
+            st = stats[src]
+            if st is None:
+                _print("{0} does not appear to exist, skipping in {1}...".format(src, config))
+                if existing.pop(name, False):
+                    os.unlink(link, dir_fd=dir_fd)
                 continue
 
+            # get the local time of the symlink, formatting each distinct mtime once
+            mtime = int(st.st_mtime)
+            stattime = stattimes.get(mtime)
+            if stattime is None:
+                stattime = time.strftime('%d-%b-%Y %H:%M', time.localtime(mtime))
+                stattimes[mtime] = stattime
+
             # skip the sas_base_dir
             if section == 'general' and 'SAS_BASE_DIR' in tree_name:
-                print(skipmsg)
+                _print('Skipping {0} for {1} in {2}'.format(tree_name, section, config))
                 continue
 
-            # only create symlinks
-            if section == 'general' and tree_name in ['CAS_LOAD', 'STAGING_DATA']:
-                # only create links here if the target exist
-                if os.path.exists(src):
-                    make_symlink(src, link)
-                else:
-                    print(skipmsg)
-            else:
-                print('Processing {0} for {1}'.format(tree_name, section))
-                make_symlink(src, link)
+            # only create symlinks; the target is known to exist from the stat above
+            if not (section == 'general' and tree_name in ['CAS_LOAD', 'STAGING_DATA']):
+                _print('Processing {0} for {1} in {2}'.format(tree_name, section, config))
+            try:
+                make_symlink(src, link, dir_fd=dir_fd)
+            except OSError as err:
+                _print('Could not create the {0} link for {1} in {2}: {3}'.format(
+                    tree_name, section, config, err))
+                continue
+            existing[name] = True
+
+            # create the table entry for the new link
+            table.append(table_row.format(name, stattime))
+
+    table.append(table_footer)
+    return ''.join(table)
 
-            # create the table entry
-            if os.path.exists(link):
-                table += '    <tr><td><a href="{0}/">{0}/</a></td><td>-</td><td>{1}</td></tr>\n'.format(tree_name.upper(), stattime)
 
-    table += table_footer
-    return table
+def get_index_templates(mirror=None):
+    ''' Get the env index page header and footer templates
 
+    Fills in the site url and location, leaving only the config name to be
+    formatted in for each tree config.
 
-def create_index_page(environ, defaults, envdir):
+    Parameters:
+        mirror (bool):
+            If True, use the SAM url location
+    Returns:
+        A tuple of the header and footer templates
+    '''
+    url = "https://data.mirror.sdss.org" if mirror else "https://data.sdss.org"
+    location = ("SDSS-IV Science Archive Mirror (SAM)" if mirror else
+                "SDSS-IV Science Archive Server (SAS)")
+    return tuple(template.replace('{url}', url).replace('{location}', location)
+                 for template in (INDEX_HEADER, INDEX_FOOTER))
+
+
+def create_index_page(environ, defaults, envdir, existing=None, templates=None, dir_fd=None):
     ''' create the env index html page
 
     Builds the index.html page containing a table of symlinks
@@ -125,37 +313,27 @@ def create_index_page(environ, defaults, envdir):
             The defaults dictionary from environ['default']
         envdir (str):
             The filepath for the env directory
+        existing (dict):
+            The scanned contents of envdir, as returned by _scan_links
+        templates (tuple):
+            The header and footer templates, as returned by get_index_templates
+        dir_fd (int):
+            An open descriptor for envdir, used to create the links relative to it
     Returns:
         A string defintion of an html page
     '''
 
-    # header of index file
-    header = """<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
-<html xmlns="http://www.w3.org/1999/xhtml">
-<head><meta name="viewport" content="width=device-width"/><meta http-equiv="content-type" content="text/html; charset=utf-8"/><style type="text/css">body,html {{background:#fff;font-family:"Bitstream Vera Sans","Lucida Grande","Lucida Sans Unicode",Lucidux,Verdana,Lucida,sans-serif;}}tr:nth-child(even) {{background:#f4f4f4;}}th,td {{padding:0.1em 0.5em;}}th {{text-align:left;font-weight:bold;background:#eee;border-bottom:1px solid #aaa;}}#list {{border:1px solid #aaa;width:100%%;}}a {{color:#a33;}}a:hover {{color:#e33;}}</style>
-<link rel="stylesheet" href="{url}/css/sas.css" type="text/css"/>
-<title>Index of /sas/{name}/env/</title>
-</head><body><h1>Index of /sas/{name}/env/</h1>
-"""
+    header, footer = templates or get_index_templates()
 
-    # footer of index file
-    footer = """<h3><a href='{url}/sas/'>{location}</a></h3>
-<p>This directory contains links to the contents of
-environment variables defined by the tree product, version {name}.
-To examine the <em>types</em> of files contained in each environment variable
-directory, visit <a href="/datamodel/files/">the datamodel.</a></p>
-</body></html>
-"""
     # create index html file
-    index = header.format(**defaults)
-    index += create_index_table(environ, envdir)
-    index += footer.format(**defaults)
+    index = ''.join([header.format(name=defaults['name']),
+                     create_index_table(environ, envdir, existing=existing, dir_fd=dir_fd),
+                     footer.format(name=defaults['name'])])
 
     return index
 
 
-def create_env(environ, mirror=None, verbose=None):
+def create_env(environ, mirror=None, verbose=None, templates=None):
     ''' create the env symlink directory structure
 
     Creates the env folder filled with symlinks to datamodel directories
@@ -168,29 +346,42 @@ def create_env(environ, mirror=None, verbose=None):
             If True, use the SAM url location
         verbose (bool):
             If True, print more information
+        templates (tuple):
+            Prebuilt index page templates, as returned by get_index_templates.
+            Overrides mirror.
     '''
 
-    defaults = environ['default'].copy()
-    defaults['url'] = "https://data.mirror.sdss.org" if mirror else "https://data.sdss.org"
-    defaults['location'] = "SDSS-IV Science Archive Mirror (SAM)" if mirror else "SDSS-IV Science Archive Server (SAS)"
+    templates = templates or get_index_templates(mirror=mirror)
 
     if not os.path.exists(environ['general']['SAS_ROOT']):
         if verbose:
-            print("{0} doesn't exist, skipping env link creation.".format(environ['general']['SAS_ROOT']))
+            _print("{0} doesn't exist, skipping env link creation.".format(environ['general']['SAS_ROOT']))
         return
 
     if verbose:
-        print("Found {0}.".format(environ['general']['SAS_ROOT']))
+        _print("Found {0}.".format(environ['general']['SAS_ROOT']))
 
     # sets and creates envdir
     envdir = os.path.join(environ['general']['SAS_ROOT'], 'env')
-    if not os.path.exists(envdir):
-        os.makedirs(envdir)
+    os.makedirs(envdir, exist_ok=True)
     if not os.access(envdir, os.W_OK):
         return
 
-    # create index html
-    index = create_index_page(environ, defaults, envdir)
+    # scan the existing env links once
+    existing = _scan_links(envdir)
+
+    # open the envdir once so the links are created relative to it
+    dir_fd = os.open(envdir, os.O_RDONLY | os.O_DIRECTORY) if _HAS_DIR_FD else None
+    try:
+        # clear out temporary links from any killed runs
+        _remove_stale_links(existing, envdir, dir_fd=dir_fd)
+
+        # create index html
+        index = create_index_page(environ, environ['default'], envdir, existing=existing,
+                                  templates=templates, dir_fd=dir_fd)
+    finally:
+        if dir_fd is not None:
+            os.close(dir_fd)
 
     # write the index file
     indexfile = os.path.join(envdir, 'index.html')
@@ -278,7 +469,7 @@ def write_version(name):
     return modules_version
 
 
-def write_file(environ, term='bash', out_dir=None, tree_dir=None, default=None):
+def write_file(environ, term='bash', out_dir=None, tree_dir=None):
     ''' Write a tree environment file
 
     Loops over the tree environ and writes them out to a bash, tsch, or
@@ -293,8 +484,6 @@ def write_file(environ, term='bash', out_dir=None, tree_dir=None, default=None):
             The path to this repository
         out_dir (str):
             The output path to write the files (default is etc/)
-        default (str):
-            The default config to write into the .version file
 
     '''
 
@@ -304,71 +493,102 @@ def write_file(environ, term='bash', out_dir=None, tree_dir=None, default=None):
     exts = {'bash': '.sh', 'tsch': '.csh', 'modules': '.module'}
     ext = exts[term]
 
-    # shell command
+    # shell command, bound once for the loop below
     if term == 'bash':
-        cmd = 'export {0}={1}\n'
+        cmd = 'export {0}={1}\n'.format
     else:
-        cmd = 'setenv {0} {1}\n'
+        cmd = 'setenv {0} {1}\n'.format
+    sas_base_dir = os.getenv("SAS_BASE_DIR")
+
+    # build the environment config content
+    out = [header, '\n']
+    for key, values in environ.items():
+        if key != 'default':
+            # write separator, even for a section with no entries
+            out.append('#\n# {0}\n#\n'.format(key))
+            # write tree names and paths
+            for tree_name, tree_path in values.items():
+                if tree_path.startswith(sas_base_dir):
+                    out.append(cmd(tree_name.upper(), tree_path))
 
     # write the environment config files
     filename = os.path.join(out_dir, name + ext)
     with open(filename, 'w') as f:
-        f.write(header + '\n')
-        for key, values in environ.items():
-            if key != 'default':
-                # write separator
-                f.write('#\n# {0}\n#\n'.format(key))
-                # write tree names and paths
-                for tree_name, tree_path in values.items():
-                    if tree_path.startswith(os.getenv("SAS_BASE_DIR")):
-                        f.write(cmd.format(tree_name.upper(), tree_path))
-
-    # write default .version file for modules (or default for lua modules)
-    default = default if default else name
-    modules_version = write_version(default)
-    if term == 'modules' and environ['default']['current'] == 'True':
-        # write .version file for tcl
-        version_name = os.path.join(out_dir, '.version')
-        with open(version_name, 'w') as f:
-            f.write(modules_version)
+        f.write(''.join(out))
+
+
+def write_version_file(environ, out_dir=None, default=None):
+    ''' Write the default .version file for modules
+
+    Parameters:
+        environ (dict):
+            The tree dictionary environment of the current config
+        out_dir (str):
+            The output path to write the file (default is etc/)
+        default (str):
+            The default config to write into the .version file
+    '''
+
+    # write .version file for tcl (or default for lua modules)
+    default = default if default else environ['default']['name']
+    version_name = os.path.join(out_dir, '.version')
+    with open(version_name, 'w') as f:
+        f.write(write_version(default))
 
 
 def get_python_path():
-    ''' Finds and switches to the tree python package directory '''
+    ''' Finds and adds the tree python package directory to the system path '''
     # get the TREE directory
     tree_dir = os.getenv('TREE_DIR', None)
-    if not tree_dir:
-        path = os.path.dirname(os.path.abspath(__file__))
-        tree_dir = os.path.realpath(os.path.join(path, '..'))
-    pypath = os.path.join(tree_dir, 'python')
+    pypath = os.path.join(tree_dir, 'python') if tree_dir else _PYPATH
 
     if pypath not in sys.path:
-        sys.path.append(pypath)
-    os.chdir(pypath)
+        sys.path.insert(0, pypath)
+
+
+def _prepare_tree_import():
+    ''' Ensure the tree package is importable
+
+    The Tree class is only looked up and imported on the first call.
+
+    Returns:
+        the Python Tree class
+    '''
+    global _Tree
+    if _Tree is not None:
+        return _Tree
+
+    # ensure the tree package is importable
+    mod = importlib.util.find_spec('tree')
+    if not (mod and mod.origin):
+        get_python_path()
+
+    from tree.tree import Tree
+    _Tree = Tree
+    return _Tree
 
 
-def get_tree(config=None):
+def get_tree(config=None, tree_class=None):
     ''' Get the tree for a given config
 
     Parameters:
         config (str):
             The name of the tree config to load
+        tree_class (type):
+            The Tree class to instantiate.  If None, it is imported first.
 
     Returns:
         a Python Tree instance
     '''
 
-    # ensure the tree package is importable
-    mod = importlib.util.find_spec('tree')
-    if not (mod and mod.origin):
-        get_python_path()
+    if tree_class is None:
+        tree_class = _prepare_tree_import()
 
     # extract the config format from either XXXX.cfg or full filepath
     has_cfg = re.search(r'(\w+)\.cfg', config)
     if has_cfg:
         config = has_cfg.group()
-    from tree.tree import Tree
-    tree = Tree(config=config)
+    tree = tree_class(config=config)
     return tree
 
 
@@ -377,7 +597,7 @@ def copy_modules(filespath=None, modules_path=None, verbose=None, default=None):
 
     # find or define a modules path
     if not modules_path:
-        modulepath = os.getenv("MODULEPATH")
+        modulepath = _ENV.get("MODULEPATH")
         if not modulepath:
             modules_path = input('Enter the root path for your module files:')
         else:
@@ -415,10 +635,16 @@ def copy_modules(filespath=None, modules_path=None, verbose=None, default=None):
 
     # check for the tree module directory
     tree_mod = os.path.join(modules_path, 'tree')
-    if not os.path.isdir(tree_mod):
-        if verbose:
-            print('Creating module tree directory: {0}'.format(tree_mod))
+    try:
         os.makedirs(tree_mod)
+        created = True
+    except FileExistsError:
+        created = False
+
+    # prompt outside the except block, so an EOF or interrupt is not chained to it
+    if created:
+        if verbose:
+            print('Created module tree directory: {0}'.format(tree_mod))
     else:
         doit = input('{0} already exists! Overwrite? (y/n) \n'.format(tree_mod)) or 'n'
         if doit == 'n':
@@ -427,24 +653,51 @@ def copy_modules(filespath=None, modules_path=None, verbose=None, default=None):
     # copy the modules into the tree
     if verbose:
         print('Copying modules from {1} into {0}'.format(tree_mod, filespath))
-    module_files = glob.glob(os.path.join(filespath, '*.module'))
+    module_files = _find_files(filespath, '.module')
     for mfile in module_files:
         base = os.path.splitext(os.path.basename(mfile))[0]
         tree_out = os.path.join(tree_mod, base)
-        shutil.copy2(mfile, tree_out)
+        _copy_file(mfile, tree_out)
 
     # copy the default .version into the tree
-    version = os.path.join(filespath, '.version')
-    if os.path.isfile(version):
-        shutil.copy2(version, tree_mod)
+    try:
+        _copy_file(os.path.join(filespath, '.version'), os.path.join(tree_mod, '.version'))
+    except FileNotFoundError:
+        pass
 
     # write default file for lua
     if default:
         defpath = os.path.join(tree_mod, 'default')
-        realpath = default
-        if os.path.islink(defpath):
-            os.unlink(defpath)
-        os.symlink(realpath, defpath)
+        make_symlink(default, defpath)
+
+
+def setup_configs(environs, opts, etcdir, templates=None):
+    ''' Set up a group of tree configs
+
+    Creates the env symlinks or writes out the tree module, bash, and tsch files
+    for each config in turn.  When creating env links, configs sharing a SAS root
+    are grouped together, so they never write into the same env directory
+    concurrently.
+
+    Parameters:
+        environs (list):
+            A list of tree dictionary environments
+        opts (Namespace):
+            The parsed command-line options
+        etcdir (str):
+            The output path to write the files
+        templates (tuple):
+            Prebuilt env index page templates, as returned by get_index_templates
+    '''
+
+    for environ in environs:
+        # create env symlinks or write out tree module/bash files
+        if opts.env:
+            create_env(environ, mirror=opts.mirror, templates=templates)
+        else:
+            write_file(environ, term='modules', out_dir=etcdir, tree_dir=opts.treedir)
+            write_file(environ, term='bash', out_dir=etcdir, tree_dir=opts.treedir)
+            write_file(environ, term='tsch', out_dir=etcdir, tree_dir=opts.treedir)
 
 
 def check_output_dir(output_dir):
@@ -455,8 +708,7 @@ def check_output_dir(output_dir):
         output_dir = os.path.expanduser('~/.tree/environments')
 
     # create directory if it does not exist
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
 
     return output_dir
 
@@ -467,14 +719,16 @@ def get_parser():
     description = ('Create bash, tsch, and module environment configuration files '
                    'defining relevant variables for accessing data products on '
                    'the SDSS Science Archive Server (SAS)')
+    import argparse
+
     parser = argparse.ArgumentParser(prog='setup_tree.py', description=description)
     parser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
                         help='Print extra information.', default=False)
-    parser.add_argument('-r', '--root', action='store', dest='root', default=os.getenv('SAS_BASE_DIR'),
+    parser.add_argument('-r', '--root', action='store', dest='root', default=_ENV.get('SAS_BASE_DIR'),
                         help='Override the environment variable $SAS_BASE_DIR.', metavar='SAS_BASE_DIR')
-    parser.add_argument('-t', '--treedir', action='store', dest='treedir', default=os.getenv('TREE_DIR'),
+    parser.add_argument('-t', '--treedir', action='store', dest='treedir', default=_ENV.get('TREE_DIR'),
                         help='Override the environment variable $TREE_DIR.', metavar='TREE_DIR')
-    parser.add_argument('-m', '--modulesdir', action='store', dest='modulesdir', default=os.getenv('MODULES_DIR'),
+    parser.add_argument('-m', '--modulesdir', action='store', dest='modulesdir', default=_ENV.get('MODULES_DIR'),
                         help='Your modules directory.  Defaults to $MODULES_DIR', metavar='MODULES_DIR')
     parser.add_argument('-e', '--env', action='store_true', dest='env',
                         help='Create tree environment symlinks.', default=False)
@@ -490,10 +744,64 @@ def get_parser():
     return parser
 
 
+# option names mapped to their destination and whether they take a value; keep
+# in sync with get_parser
+_OPTIONS = {'-v': ('verbose', False), '--verbose': ('verbose', False),
+            '-r': ('root', True), '--root': ('root', True),
+            '-t': ('treedir', True), '--treedir': ('treedir', True),
+            '-m': ('modulesdir', True), '--modulesdir': ('modulesdir', True),
+            '-e': ('env', False), '--env': ('env', False),
+            '-i': ('mirror', False), '--mirror': ('mirror', False),
+            '-o': ('only', True), '--only': ('only', True),
+            '-d': ('default', True), '--default': ('default', True),
+            '-p': ('path', True), '--path': ('path', True)}
+
+
+def parse_args(args):
+    ''' Parse the command-line arguments
+
+    Handles the plain forms of the options defined in get_parser directly, and
+    falls back to the full argparse parser for help, errors, or any other
+    argument syntax.
+
+    Parameters:
+        args (list):
+            The command-line arguments, without the program name
+
+    Returns:
+        A namespace of the parsed options
+    '''
+
+    opts = {'verbose': False, 'root': _ENV.get('SAS_BASE_DIR'), 'treedir': _ENV.get('TREE_DIR'),
+            'modulesdir': _ENV.get('MODULES_DIR'), 'env': False, 'mirror': False, 'only': None,
+            'default': 'sdsswork', 'path': None}
+
+    items = iter(args)
+    for arg in items:
+        name, sep, value = arg.partition('=') if arg.startswith('--') else (arg, '', '')
+        if name not in _OPTIONS:
+            return get_parser().parse_args(args)
+
+        dest, takes_value = _OPTIONS[name]
+        if not takes_value:
+            if sep:
+                return get_parser().parse_args(args)
+            opts[dest] = True
+            continue
+
+        if not sep:
+            value = next(items, None)
+            if value is None or value.startswith('-'):
+                return get_parser().parse_args(args)
+        opts[dest] = value
+
+    return types.SimpleNamespace(**opts)
+
+
 def main(args):
 
     # parse arguments
-    opts = get_parser().parse_args()
+    opts = parse_args(args)
 
     # check for a treedir; if none found, set path to the parent directory
     if not opts.treedir:
@@ -516,7 +824,7 @@ def main(args):
         print('Output Directory: ', etcdir)
 
     # config files
-    configs = glob.glob(os.path.join(datadir, '*.cfg'))
+    configs = _find_files(datadir, '.cfg')
     if not configs:
         print('No config files found in {0}.  Cannot proceed with tree setup. '
               'Check for correct TREE_DIR.'.format(datadir))
@@ -525,26 +833,45 @@ def main(args):
     # check for the SAS_BASE_DIR
     check_sas_base_dir(root=opts.root)
 
-    # Read and write the configuration files
+    # import the Tree class once for all configs
+    tree_class = _prepare_tree_import()
+
+    # load the tree for each config to process; env links are grouped by SAS root so
+    # configs sharing an env directory are never processed concurrently
+    groups = {}
     for cfgfile in configs:
         # skip basework config
         if 'basework' in cfgfile:
             continue
 
-        tree = get_tree(config=cfgfile)
-        # create env symlinks or write out tree module/bash files
-        if opts.env:
-            # skip creating the environ if a specific config if specified
-            if opts.only and opts.only not in cfgfile:
-                continue
-            create_env(tree.environ, mirror=opts.mirror)
-        else:
-            write_file(tree.environ, term='modules', out_dir=etcdir, tree_dir=opts.treedir, default=opts.default)
-            write_file(tree.environ, term='bash', out_dir=etcdir, tree_dir=opts.treedir)
-            write_file(tree.environ, term='tsch', out_dir=etcdir, tree_dir=opts.treedir)
+        # skip creating the environ if a specific config if specified
+        if opts.env and opts.only and opts.only not in cfgfile:
+            continue
+
+        tree = get_tree(config=cfgfile, tree_class=tree_class)
+        key = tree.environ['general']['SAS_ROOT'] if opts.env else cfgfile
+        groups.setdefault(key, []).append(tree.environ)
+
+    # build the env index page templates once for all configs
+    templates = get_index_templates(mirror=opts.mirror) if opts.env else None
+
+    # Read and write the configuration files, one group per worker thread
+    if groups:
+        with ThreadPoolExecutor(max_workers=min(8, len(groups))) as executor:
+            futures = [executor.submit(setup_configs, environs, opts, etcdir, templates=templates)
+                       for environs in groups.values()]
+            for future in as_completed(futures):
+                future.result()
+
+    # write the shared .version file once, from the last current config in scan order
+    if not opts.env:
+        current = [environ for environs in groups.values() for environ in environs
+                   if environ['default']['current'] == 'True']
+        if current:
+            write_version_file(current[-1], out_dir=etcdir, default=opts.default)
 
     # check for files
-    module_files = glob.glob(os.path.join(etcdir, '*.module'))
+    module_files = _find_files(etcdir, '.module')
     if not any(module_files):
         print('No module files created in {0}'.format(etcdir))
     else:
@@ -17,11 +17,22 @@ import subprocess
 import pytest
 import glob
 import sys
+import errno
+import importlib.util
 from tree import Tree
 
 setuppath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../bin/setup_tree.py'))
 
 
+@pytest.fixture(scope='module')
+def setup_tree():
+    # load the setup_tree script as a module
+    spec = importlib.util.spec_from_file_location('setup_tree', setuppath)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    yield mod
+
+
 @pytest.fixture()
 def tree(faketree):
     # create the fake tree
@@ -84,6 +95,28 @@ def test_envlinks(tree, name):
     assert_stuff(envdir, name)
 
 
+def test_envlinks_failed_link(tree):
+    envdir = os.path.join(tree.environ['general']['SAS_BASE_DIR'], 'dr15/env')
+    # a real directory blocks the MANGA_SPECTRO_REDUX symlink
+    os.makedirs(os.path.join(envdir, 'MANGA_SPECTRO_REDUX'))
+    stdout = run_cmd(args=['-e'])
+    assert 'Could not create the MANGA_SPECTRO_REDUX link' in str(stdout)
+    page = read_index(os.path.join(envdir, 'index.html'))
+    assert 'href="MANGA_SPECTRO_REDUX/"' not in page
+    assert 'href="MANGA_HI/"' in page
+
+
+def test_envlinks_stale_tmp(tree):
+    envdir = os.path.join(tree.environ['general']['SAS_BASE_DIR'], 'dr15/env')
+    # a temporary link left behind by a killed run
+    os.makedirs(envdir)
+    stale = os.path.join(envdir, 'MANGA_HI.12345.tmp')
+    os.symlink(tree.environ['general']['SAS_BASE_DIR'], stale)
+    run_cmd(args=['-e'])
+    assert not os.path.lexists(stale)
+    assert os.path.islink(os.path.join(envdir, 'MANGA_HI'))
+
+
 @pytest.mark.parametrize('name', [('MANGA_HI'), ('MANGA_SPECTRO_REDUX')], ids=['mangahi', 'redux'])
 def test_env_only(tree, name):
     dr15envdir = os.path.join(tree.environ['general']['SAS_BASE_DIR'], 'dr15/env')
@@ -129,6 +162,18 @@ def test_create_files(tree, config):
     assert os.path.exists(os.path.join(moduledir, config))
 
 
+def test_version_file_no_default(tree):
+    # every current config is a candidate; the last one in scan order must win intact
+    etcdir = os.path.join(os.getenv('TREE_DIR'), 'etc')
+    datadir = os.path.join(os.getenv('TREE_DIR'), 'data')
+    defaults = [Tree(config=e.name).environ['default'] for e in os.scandir(datadir)
+                if e.name.endswith('.cfg') and 'basework' not in e.name]
+    current = [d['name'] for d in defaults if d['current'] == 'True']
+    run_cmd(args=['-d', ''])
+    version = read_index(os.path.join(etcdir, '.version'))
+    assert version == '#%Module1.0\nset ModulesVersion {0}'.format(current[-1])
+
+
 @pytest.fixture()
 def resetmod(monkeypatch):
     mdir = os.environ.get('MODULES_DIR')
@@ -193,3 +238,32 @@ def test_emptymodulepath(tree, resetmod, config, inputs):
         for mpath in split_mods:
             path = os.path.join(mpath, 'tree')
             assert_paths(path, config)
+
+
+def test_copy_file_fallback(setup_tree, monkeypatch, tmp_path):
+    src = tmp_path / 'dr15.module'
+    src.write_bytes(b'#%Module1.0\n' * 1000)
+    dst = tmp_path / 'dr15'
+
+    def nosendfile(*args):
+        raise OSError(errno.EINVAL, 'Invalid argument')
+
+    monkeypatch.setattr(os, 'sendfile', nosendfile, raising=False)
+    setup_tree._copy_file(str(src), str(dst))
+    assert dst.read_bytes() == src.read_bytes()
+
+
+@pytest.mark.parametrize('args', [[], ['-v', '-e'], ['-e', '-o', 'dr14'],
+                                  ['--only=dr14', '--mirror'],
+                                  ['-r', '/x', '-t', '/y', '-m', '/z', '-d', 'dr15', '-p', '/q'],
+                                  ['--path', '/q', '-i'], ['--root=/x'], ['--root='], ['-ve'],
+                                  ['--verb'], ['-o', '-e'], ['--path=a=b'], ['--env=1'], ['-x']])
+def test_parse_args(setup_tree, args):
+    # the fast parser must agree with the argparse parser, including its errors
+    try:
+        expected = vars(setup_tree.get_parser().parse_args(args))
+    except SystemExit:
+        with pytest.raises(SystemExit):
+            setup_tree.parse_args(args)
+    else:
+        assert vars(setup_tree.parse_args(args)) == expected